@@ -0,0 +1,193 @@
+import os
+from random import Random
+from circuit import Circuit
+from logic_module import general_op_bits
+
+
+def repeat_bits(block: int, block_len: int, count: int) -> int:
+    """
+    Returns an integer made of count copies of block placed next to each other.
+    :param block: block of bits
+    :param block_len: number of bits in block
+    :param count: number of copies
+    :return: repeated block
+    """
+    if count == 0:
+        return 0
+    return block * (((1 << (block_len * count)) - 1) // ((1 << block_len) - 1))
+
+
+def known(bits: int, mask: int) -> tuple[int, int]:
+    """
+    Returns packed values in three-valued form (see general_op_bits) with all patterns known.
+    :param bits: packed values
+    :param mask: mask of bits used by the patterns
+    :return: pair (ones, zeros)
+    """
+    return bits, ~bits & mask
+
+
+def simulate_bits(c: Circuit, values: dict) -> dict:
+    """
+    Simulates many patterns of the circuit at once in three-valued logic. Each bit of packed value belongs to one
+    pattern. Gates are evaluated in topological order, gates of cycles created by locking start from unknown value and
+    are evaluated repeatedly until no value changes. Patterns for which a cycle has no stable value stay unknown.
+    :param c: Circuit
+    :param values: packed values of input and key gates (see known)
+    :return: packed values of all gates
+    """
+    index = c.get_index()
+    cyclic = {index.component_of()[scc[0]] for scc in index.cycles()}
+    res = {name: (0, 0) for name in c.gates}
+    res.update(values)
+    for i, scc in enumerate(index.strongly_connected_components()):
+        logic = [(name, c.gates[name].operation, c.gates[name].inputs)
+                 for name in scc if c.gates[name].operation != 'input']
+        changed = True
+        while changed:
+            changed = False
+            for name, operation, inputs in logic:
+                val = general_op_bits(operation, [res[j] for j in inputs])
+                if val != res[name]:
+                    res[name] = val
+                    changed = True
+            if i not in cyclic:
+                break
+    return res
+
+
+def wrong_bits(value: tuple[int, int], expected: int, mask: int) -> int:
+    """
+    Returns bits of patterns where value differs from expected value or is unknown.
+    :param value: packed values in three-valued form
+    :param expected: expected packed values
+    :param mask: mask of bits used by the patterns
+    :return: bits of wrong patterns
+    """
+    return ~(value[0] & expected | value[1] & ~expected) & mask
+
+
+def key_to_int(key: list[bool]) -> int:
+    """
+    Returns key packed to an integer (1st key bit is the lowest bit).
+    :param key: key
+    :return: packed key
+    """
+    return sum(1 << i for i, b in enumerate(key) if b)
+
+
+def spread_bits(selector: int, count: int, block_len: int) -> int:
+    """
+    Returns an integer where each bit of selector is expanded to block_len bits.
+    :param selector: bits to expand
+    :param count: number of bits in selector
+    :param block_len: number of bits in one block
+    :return: expanded bits
+    """
+    block = (1 << block_len) - 1
+    res = 0
+    for i in range(count):
+        if selector >> i & 1:
+            res |= block << (i * block_len)
+    return res
+
+
+def key_corruption(c: Circuit, num_keys=64, num_inputs=64, seed=None) -> dict:
+    """
+    Samples num_keys wrong keys and num_inputs input patterns and simulates every pair of them in one bit-parallel pass.
+    Outputs are compared with the outputs of the circuit unlocked with its correct key, unknown outputs (wrong key
+    creates a cycle without stable value) count as wrong. Then each key bit of the correct key is flipped on its own,
+    which measures sensitivity of outputs to each key bit.
+    Returned dict contains:
+    samples -> number of simulated (wrong key, input) pairs
+    corruption_rate -> ratio of samples with at least one wrong output
+    unknown_rate -> ratio of samples with at least one unknown output
+    hamming_distance -> average number of wrong outputs per sample
+    output_hamming -> ratio of samples with wrong value for each output
+    key_sensitivity -> ratio of input patterns with wrong outputs when only given key bit is flipped
+    :param c: locked Circuit
+    :param num_keys: number of sampled wrong keys
+    :param num_inputs: number of sampled input patterns
+    :param seed: seed of random generator
+    :return: analysis results
+    """
+    if not c.key_gates or len(c.correct_key) != len(c.key_gates):
+        raise ValueError(f'Circuit {c.file_name} is not locked or has no correct key.')
+    rng = Random(seed)
+    n_key = len(c.key_gates)
+    correct = key_to_int(c.correct_key)
+    input_blocks = [rng.getrandbits(num_inputs) for _ in c.input_gates]
+    block_mask = (1 << num_inputs) - 1
+
+    ref_values = {name: known(block, block_mask) for name, block in zip(c.input_gates, input_blocks)}
+    for name, b in zip(c.key_gates, c.correct_key):
+        ref_values[name] = known(block_mask if b else 0, block_mask)
+    ref = {name: val[0] for name, val in simulate_bits(c, ref_values).items()}
+
+    wrong_keys = []
+    while len(wrong_keys) < num_keys:
+        k = rng.getrandbits(n_key)
+        if k != correct:
+            wrong_keys.append(k)
+    width = num_keys * num_inputs
+    mask = (1 << width) - 1
+    values = {name: known(repeat_bits(block, num_inputs, num_keys), mask)
+              for name, block in zip(c.input_gates, input_blocks)}
+    for b, name in enumerate(c.key_gates):
+        selector = sum(1 << i for i, k in enumerate(wrong_keys) if k >> b & 1)
+        values[name] = known(spread_bits(selector, num_keys, num_inputs), mask)
+    res = simulate_bits(c, values)
+
+    corrupted = 0
+    unknown = 0
+    output_hamming = dict()
+    total = 0
+    for name in c.output_gates:
+        diff = wrong_bits(res[name], repeat_bits(ref[name], num_inputs, num_keys), mask)
+        unknown |= ~(res[name][0] | res[name][1]) & mask
+        corrupted |= diff
+        cnt = diff.bit_count()
+        total += cnt
+        output_hamming[name] = cnt / width
+
+    n_sens = n_key * num_inputs
+    full = (1 << n_sens) - 1
+    values = {name: known(repeat_bits(block, num_inputs, n_key), full)
+              for name, block in zip(c.input_gates, input_blocks)}
+    for b, name in enumerate(c.key_gates):
+        values[name] = known((full if c.correct_key[b] else 0) ^ (block_mask << (b * num_inputs)), full)
+    sens = simulate_bits(c, values)
+    sens_corrupted = 0
+    for name in c.output_gates:
+        sens_corrupted |= wrong_bits(sens[name], repeat_bits(ref[name], num_inputs, n_key), full)
+    key_sensitivity = dict()
+    for b, name in enumerate(c.key_gates):
+        key_sensitivity[name] = (sens_corrupted >> (b * num_inputs) & block_mask).bit_count() / num_inputs
+
+    return {'samples': width,
+            'corruption_rate': corrupted.bit_count() / width,
+            'unknown_rate': unknown.bit_count() / width,
+            'hamming_distance': total / width,
+            'output_hamming': output_hamming,
+            'key_sensitivity': key_sensitivity}
+
+
+def profile_directory(directory='cyclocked', num_keys=64, num_inputs=64, seed=None, details=True) -> dict:
+    """
+    Runs key_corruption on every locked circuit in directory.
+    :param directory: directory with .bench files of locked circuits
+    :param num_keys: number of sampled wrong keys
+    :param num_inputs: number of sampled input patterns
+    :param seed: seed of random generator
+    :param details: print results of each circuit
+    :return: analysis results for each file
+    """
+    results = dict()
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.endswith('.bench'):
+            c = Circuit(os.path.join(directory, file_name))
+            results[file_name] = key_corruption(c, num_keys, num_inputs, seed)
+            if details:
+                print(f'{file_name}: corruption rate {round(results[file_name]["corruption_rate"] * 100, 3)}%, '
+                      f'hamming distance {round(results[file_name]["hamming_distance"], 3)}')
+    return results
@@ -1,7 +1,16 @@
+import time
 from pysat.solvers import Solver
-from copy import deepcopy
+from copy import copy
+from itertools import chain
+from threading import Timer
 from collections import OrderedDict
 from circuit import Circuit
+from clause_module import ClauseStore
+
+CONVERGED = 'converged'
+BUDGET_EXHAUSTED = 'budget-exhausted'
+ITERATION_LIMIT = 'iteration-limit'
+KEY_GRACE_TIME = 1.0
 
 
 def swap_dict(d: dict) -> dict:
@@ -83,13 +92,15 @@ def tseytin(operand: str, output: int, input_a: int, input_b=None) -> list[list[
     return cnf
 
 
-def circuit_to_cnf(c: Circuit) -> list[list[int]]:
+def circuit_to_cnf(c: Circuit, cnf=None) -> list[list[int]]:
     """
     Creates cnf formula representing circuit.
     :param c: Circuit
+    :param cnf: list or ClauseStore to which clauses are added (new list if not given)
     :return: cnf formula representing circuit
     """
-    cnf = []
+    if cnf is None:
+        cnf = []
     for name in c.gates:
         if c.gates[name].operation != 'input':
             if len(c.gates[name].inputs) == 1:
@@ -104,15 +115,36 @@ def circuit_to_cnf(c: Circuit) -> list[list[int]]:
     return cnf
 
 
-def solve_cnf(cnf: list[list[int]], solver_name='m22') -> (bool, list[int]):
+def solve_cnf(cnf, solver_name='m22', conf_budget=None, prop_budget=None, deadline=None) -> (bool, list[int]):
     """
-    Creates an instance of SAT Slover and solves cnf. Returns bool (sat) and model (value assignment).
-    :param cnf: cnf
+    Creates an instance of SAT Slover and solves cnf. Returns bool (sat) and model (value assignment). If any budget is
+    given, the solver stops when it runs out and sat is None.
+    :param cnf: cnf (any iterable of clauses, e.g. ClauseStore)
     :param solver_name: name of sat solver
+    :param conf_budget: max number of conflicts
+    :param prop_budget: max number of propagations
+    :param deadline: time (time.monotonic) when the solver is interrupted
     :return: sat, value assignment
     """
-    solver = Solver(name=solver_name, bootstrap_with=cnf)
-    is_sat = solver.solve()
+    if deadline is not None and deadline <= time.monotonic():
+        return None, None
+    solver = Solver(name=solver_name)
+    solver.append_formula(cnf)
+    if conf_budget is None and prop_budget is None and deadline is None:
+        is_sat = solver.solve()
+    else:
+        if conf_budget is not None:
+            solver.conf_budget(conf_budget)
+        if prop_budget is not None:
+            solver.prop_budget(prop_budget)
+        timer = None
+        if deadline is not None:
+            timer = Timer(max(deadline - time.monotonic(), 0), solver.interrupt)
+            timer.start()
+        is_sat = solver.solve_limited(expect_interrupt=deadline is not None)
+        if timer is not None:
+            timer.cancel()
+            timer.join()
     model = solver.get_model()
     solver.delete()
     return is_sat, model
@@ -185,14 +217,17 @@ def dip_cnf(c: Circuit, dip_x: list[int], dip_y: list[int]) -> list[list[int]]:
 
 def copy_circuit_for_init(c: Circuit) -> Circuit:
     """
-    Returns a copy of circuit with new literals (except for input literals).
+    Returns a copy of circuit with new literals (except for input literals). Gates and index are shared with the
+    original circuit.
     :param c: Circuit
     :return: Circuit with new literals
     """
-    c_copy = deepcopy(c)
+    c_copy = copy(c)
+    c_copy.literals = OrderedDict(c.literals)
+    inputs = c.get_index().inputs
     new_lit = len(c.literals) + 1
     for name in c.literals:
-        if name not in c.input_gates:
+        if name not in inputs:
             c_copy.literals[name] = new_lit
             new_lit += 1
     return c_copy
@@ -200,69 +235,108 @@ def copy_circuit_for_init(c: Circuit) -> Circuit:
 
 def copy_circuit_for_dip(c: Circuit, counter: int) -> Circuit:
     """
-    Returns a copy of circuit with new literals (except for key literals).
+    Returns a copy of circuit with new literals (except for key literals). Gates and index are shared with the
+    original circuit.
     :param c: Circuit
     :param counter: coutner for where to start new literals
     :return: Circuit with new literals
     """
-    c_copy = deepcopy(c)
+    c_copy = copy(c)
+    c_copy.literals = OrderedDict(c.literals)
+    keys = c.get_index().keys
     new_lit = counter + 1
     for name in c.literals:
-        if name not in c.key_gates:
+        if name not in keys:
             c_copy.literals[name] = new_lit
             new_lit += 1
     return c_copy
 
 
-def sat_attack(c1: Circuit, oracle: Circuit, solver_name='m22', limit=100, details=True) -> (int, list[bool]):
+def sat_attack(c1: Circuit, oracle: Circuit, solver_name='m22', limit=100, details=True, mem_budget=None,
+               spill_file=None, conf_budget=None, prop_budget=None, time_limit=None) -> (int, list[bool], str):
     """
-    Performs a classic SAT attack on locked circuit.
+    Performs a classic SAT attack on locked circuit. The attack ends with status CONVERGED when no DIP is left,
+    ITERATION_LIMIT when limit is reached and BUDGET_EXHAUSTED when a solver call runs out of conf_budget or
+    prop_budget or time_limit runs out. Estimated key is consistent with all DIPs found so far, unless the last key
+    extraction is interrupted. The extraction may exceed time_limit by at most KEY_GRACE_TIME seconds, if it is
+    interrupted, the key from the last satisfiable iteration is returned. That key was found before the last DIP was
+    added, so it may not be consistent with it.
     :param c1: locked Circuit
     :param oracle: unlocked Circuit
     :param solver_name: name of SAT solver
     :param limit: max iterations
-    :param details: print details of attack
-    :return: iterations, estimated key
+    :param details: print details of attack (including memory used by clauses in each iteration)
+    :param mem_budget: max number of bytes of clauses kept in memory by ClauseStore, others are written to
+    spill_file (the SAT solver still holds all clauses, spilled clauses are read again in each iteration)
+    :param spill_file: name of file for clauses over mem_budget (temporary file is used if not given)
+    :param conf_budget: max number of conflicts of each solver call
+    :param prop_budget: max number of propagations of each solver call
+    :param time_limit: max number of seconds of the whole attack
+    :return: iterations, estimated key, status
     """
     if details:
         print(f'Performing SAT attack on {c1.file_name} ...')
+    deadline = None if time_limit is None else time.monotonic() + time_limit
     c1.simplify_gates()
+    index = c1.get_index()
     last_lit_key = list(c1.literals)[-1]
     c2 = copy_circuit_for_init(c1)
     counter = c2.literals[last_lit_key]
-    cnf_i = circuit_to_cnf(c1) + circuit_to_cnf(c2)
-    diff_out = diff_out_cnf(c1.output_literals(), c2.output_literals(), counter)
-    is_sat, model = solve_cnf(cnf_i + diff_out, solver_name)
-    i = 1
-    while is_sat and i < limit:
-        assign1 = model_to_result(c1, model)
-        dip_x = [v for k, v in assign1.items() if k in c1.input_gates]
-        dip_y = oracle.simulate(dip_x)
+    cnf_i = ClauseStore(mem_budget, spill_file)
+    try:
+        circuit_to_cnf(c1, cnf_i)
+        circuit_to_cnf(c2, cnf_i)
+        diff_out = diff_out_cnf(c1.output_literals(), c2.output_literals(), counter)
+        is_sat, model = solve_cnf(chain(cnf_i, diff_out), solver_name, conf_budget, prop_budget, deadline)
+        last_model = model if is_sat else None
+        i = 1
+        while is_sat and i < limit:
+            assign1 = model_to_result(c1, model)
+            dip_x = [v for k, v in assign1.items() if k in index.inputs]
+            dip_y = oracle.simulate(dip_x)
 
-        c1_copy = copy_circuit_for_dip(c1, counter)
-        counter = c1_copy.literals[last_lit_key]
-        c2_copy = copy_circuit_for_dip(c2, counter)
-        counter = c2_copy.literals[last_lit_key]
+            c1_copy = copy_circuit_for_dip(c1, counter)
+            counter = c1_copy.literals[last_lit_key]
+            c2_copy = copy_circuit_for_dip(c2, counter)
+            counter = c2_copy.literals[last_lit_key]
 
-        cnf1 = circuit_to_cnf(c1_copy)
-        cnf2 = circuit_to_cnf(c2_copy)
-        dip1 = dip_cnf(c1_copy, dip_x, dip_y)
-        dip2 = dip_cnf(c2_copy, dip_x, dip_y)
-        cnf_i += (cnf1 + cnf2 + dip1 + dip2)
+            circuit_to_cnf(c1_copy, cnf_i)
+            circuit_to_cnf(c2_copy, cnf_i)
+            cnf_i.extend(dip_cnf(c1_copy, dip_x, dip_y))
+            cnf_i.extend(dip_cnf(c2_copy, dip_x, dip_y))
+            if details:
+                print(f'    iteration {i}: {len(cnf_i)} clauses, {cnf_i.nbytes()} bytes in memory, '
+                      f'{cnf_i.spilled} clauses in spill file')
 
-        diff_out = diff_out_cnf(c1.output_literals(), c2.output_literals(), counter)
-        is_sat, model = solve_cnf(cnf_i + diff_out, solver_name)
-        i += 1
+            diff_out = diff_out_cnf(c1.output_literals(), c2.output_literals(), counter)
+            is_sat, model = solve_cnf(chain(cnf_i, diff_out), solver_name, conf_budget, prop_budget, deadline)
+            if is_sat:
+                last_model = model
+            i += 1
 
-    is_sat, model = solve_cnf(cnf_i, solver_name)
-    assign = model_to_result(c1, model)
-    estimated_key = [v for k, v in assign.items() if k in c1.key_gates]
+        if is_sat is None:
+            status = BUDGET_EXHAUSTED
+        elif is_sat:
+            status = ITERATION_LIMIT
+        else:
+            status = CONVERGED
+        key_deadline = None if deadline is None else deadline + KEY_GRACE_TIME
+        is_sat, model = solve_cnf(cnf_i, solver_name, conf_budget, prop_budget, key_deadline)
+        if not is_sat:
+            model = last_model
+    finally:
+        cnf_i.close()
+    estimated_key = []
+    if model is not None:
+        assign = model_to_result(c1, model)
+        estimated_key = [v for k, v in assign.items() if k in index.keys]
 
     if details:
         success = get_success_rate(c1.correct_key, estimated_key)
+        print(f'    status: {status}')
         print(f'    iterations: {i}')
         print(f'    estimated key: {"".join([str(int(b)) for b in estimated_key])}')
         print(f'    correct key:   {"".join([str(int(b)) for b in c1.correct_key])}')
         print(f'    success rate: {round(success, 3)}%')
         print()
-    return i, estimated_key
+    return i, estimated_key, status
@@ -1,5 +1,29 @@
-from collections import defaultdict, OrderedDict
-from logic_module import general_op
+import heapq
+from collections import OrderedDict
+from types import MappingProxyType
+from logic_module import general_op3
+
+
+def format_bench(correct_key: list[bool], input_gates: list[str], key_gates: list[str], output_gates: list[str],
+                 gates) -> list[str]:
+    """
+    Returns lines of .bench representation of a circuit.
+    :param correct_key: correct key
+    :param input_gates: names of input gates
+    :param key_gates: names of key gates
+    :param output_gates: names of output gates
+    :param gates: iterable of Gates in order they are written (input gates are skipped)
+    :return: lines ending with newline
+    """
+    lines = [f'#{"".join(str(int(i)) for i in correct_key)}\n']
+    lines.extend(f'INPUT({in_g})\n' for in_g in input_gates)
+    lines.extend(f'INPUT({k_g})\n' for k_g in key_gates)
+    lines.extend(f'OUTPUT({out_g})\n' for out_g in output_gates)
+    lines.append('\n')
+    for g in gates:
+        if g.operation != 'input':
+            lines.append(f'{g.name} = {g.operation}({", ".join(g.inputs)})\n')
+    return lines
 
 
 class Gate:
@@ -23,6 +47,290 @@ class Gate:
         self.value = None
 
 
+class CircuitIndex:
+    """
+    A class that holds structural information about circuit. It is built once and updated when gates are added to the
+    circuit. Topological levels and strongly connected components are computed lazily on first use after a change.
+    circuit -> indexed Circuit
+    fanout -> names of gates driven by each gate
+    inputs -> set of names of input gates
+    outputs -> set of names of output gates
+    keys -> set of names of key gates
+    """
+    def __init__(self, c: 'Circuit'):
+        """
+        Creates an index of circuit.
+        :param c: Circuit
+        """
+        self.circuit = c
+        self.fanout = dict()
+        self.inputs = set(c.input_gates)
+        self.outputs = set(c.output_gates)
+        self.keys = set(c.key_gates)
+        for g in c.gates:
+            if c.gates[g].operation != 'input':
+                for i in c.gates[g].inputs:
+                    self.fanout.setdefault(i, []).append(g)
+        self._sccs = None
+        self._scc_of = None
+        self._levels = None
+        self._order = None
+
+    def add_gate(self, gate: Gate) -> None:
+        """
+        Adds a gate which was inserted to circuit to the index. Input gates are added to keys if they are listed in
+        key_gates of the circuit.
+        :param gate: inserted Gate
+        :return: None
+        """
+        if gate.operation == 'input':
+            if gate.name in self.circuit.key_gates:
+                self.keys.add(gate.name)
+            else:
+                self.inputs.add(gate.name)
+        else:
+            for i in gate.inputs:
+                self.fanout.setdefault(i, []).append(gate.name)
+        self._sccs = None
+
+    def replace_input(self, name: str, old_input: str, new_input: str) -> None:
+        """
+        Updates the index after an input of gate was replaced by another gate.
+        :param name: name of the gate
+        :param old_input: name of previous input gate
+        :param new_input: name of new input gate
+        :return: None
+        """
+        self.fanout[old_input].remove(name)
+        self.fanout.setdefault(new_input, []).append(name)
+        self._sccs = None
+
+    def strongly_connected_components(self) -> list[list[str]]:
+        """
+        Returns strongly connected components of circuit in topological order (iterative Tarjan's algorithm). Gates
+        inside of each component keep the order of the circuit.
+        :return: list of components
+        """
+        if self._sccs is None:
+            self._build()
+        return self._sccs
+
+    def cycles(self) -> list[list[str]]:
+        """
+        Returns strongly connected components that contain a cycle.
+        :return: list of components with a cycle
+        """
+        return [scc for scc in self.strongly_connected_components()
+                if len(scc) > 1 or scc[0] in self.fanout.get(scc[0], ())]
+
+    def component_of(self) -> dict:
+        """
+        Returns index of strongly connected component of each gate.
+        :return: dict (key = name of the gate, value = index of component)
+        """
+        if self._sccs is None:
+            self._build()
+        return self._scc_of
+
+    def levels(self) -> dict:
+        """
+        Returns topological level of each gate. Input gates have level 0, gates of one strongly connected component
+        share the same level.
+        :return: dict (key = name of the gate, value = level)
+        """
+        if self._sccs is None:
+            self._build()
+        return self._levels
+
+    def order(self) -> list[str]:
+        """
+        Returns names of gates in topological order.
+        :return: names of gates
+        """
+        if self._sccs is None:
+            self._build()
+        return self._order
+
+    def _build(self) -> None:
+        """
+        Computes strongly connected components, levels and topological order.
+        :return: None
+        """
+        gates = self.circuit.gates
+        pos = {name: i for i, name in enumerate(gates)}
+        index = dict()
+        low = dict()
+        stack = []
+        on_stack = set()
+        sccs = []
+        counter = 0
+        for root in gates:
+            if root in index:
+                continue
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(self.fanout.get(root, ())))]
+            while work:
+                v, it = work[-1]
+                for w in it:
+                    if w not in index:
+                        index[w] = low[w] = counter
+                        counter += 1
+                        stack.append(w)
+                        on_stack.add(w)
+                        work.append((w, iter(self.fanout.get(w, ()))))
+                        break
+                    elif w in on_stack:
+                        low[v] = min(low[v], index[w])
+                else:
+                    work.pop()
+                    if work:
+                        u = work[-1][0]
+                        low[u] = min(low[u], low[v])
+                    if low[v] == index[v]:
+                        scc = []
+                        while True:
+                            w = stack.pop()
+                            on_stack.remove(w)
+                            scc.append(w)
+                            if w == v:
+                                break
+                        scc.sort(key=pos.get)
+                        sccs.append(scc)
+        sccs.reverse()
+
+        scc_of = dict()
+        levels = dict()
+        order = []
+        for i, scc in enumerate(sccs):
+            for name in scc:
+                scc_of[name] = i
+            level = 0
+            for name in scc:
+                if gates[name].operation != 'input':
+                    for j in gates[name].inputs:
+                        if scc_of[j] != i:
+                            level = max(level, levels[j] + 1)
+            for name in scc:
+                levels[name] = level
+            order.extend(scc)
+        self._sccs = sccs
+        self._scc_of = scc_of
+        self._levels = levels
+        self._order = order
+
+
+class Simulator:
+    """
+    Event-driven simulator of circuit in three-valued logic (True, False and None for unknown value). Values are kept
+    in gates between runs, so only the fanout cone of changed inputs is evaluated again. Strongly connected components
+    (cycles created by locking) are evaluated from unknown values until they reach a fixpoint.
+    circuit -> simulated Circuit
+    oscillating -> names of gates in cycles which have no stable value although all inputs of the cycle are known
+    """
+    def __init__(self, c: 'Circuit'):
+        """
+        Creates a simulator of circuit.
+        :param c: Circuit
+        """
+        self.circuit = c
+        self.oscillating = set()
+        self._sccs = None
+        self._cyclic = set()
+
+    def run(self, inputs: list[bool], key=None) -> list:
+        """
+        Inserts input and key values to input and key gates, evaluates gates affected by changed values and returns
+        circuits output. Outputs which could not be determined are None.
+        :param inputs: input values
+        :param key: key values (default: correct key of the circuit if it has one, else unknown)
+        :return: circuits output
+        """
+        c = self.circuit
+        index = c.get_index()
+        sccs = index.strongly_connected_components()
+        scc_of = index.component_of()
+        if key is None and len(c.correct_key) == len(c.key_gates):
+            key = c.correct_key
+        sources = dict(zip(c.input_gates, inputs))
+        for i, name in enumerate(c.key_gates):
+            sources[name] = key[i] if key is not None else None
+
+        full = self._sccs is not sccs
+        if full:
+            self._sccs = sccs
+            self._cyclic = {scc_of[scc[0]] for scc in index.cycles()}
+            self.oscillating = set()
+            for name in c.gates:
+                c.gates[name].value = None
+        changed = [name for name, val in sources.items() if c.gates[name].value != val]
+        for name in changed:
+            c.gates[name].value = sources[name]
+
+        if full or len(changed) * 2 > len(sources):
+            # most of the circuit would be evaluated anyway, a pass in topological order is cheaper than events
+            gates = c.gates
+            for i, scc in enumerate(sccs):
+                if i in self._cyclic:
+                    self._evaluate_component(scc, i, scc_of)
+                else:
+                    g = gates[scc[0]]
+                    if g.operation != 'input':
+                        g.value = general_op3(g.operation, [gates[j].value for j in g.inputs])
+            return [c.gates[name].value for name in c.output_gates]
+
+        pending = list({scc_of[g] for name in changed for g in index.fanout.get(name, ())})
+        heapq.heapify(pending)
+        queued = set(pending)
+        while pending:
+            i = heapq.heappop(pending)
+            queued.remove(i)
+            for name in self._evaluate_component(sccs[i], i, scc_of):
+                for g in index.fanout.get(name, ()):
+                    j = scc_of[g]
+                    if j != i and j not in queued:
+                        queued.add(j)
+                        heapq.heappush(pending, j)
+        return [c.gates[name].value for name in c.output_gates]
+
+    def _evaluate_component(self, scc: list[str], i: int, scc_of: dict) -> list[str]:
+        """
+        Evaluates a strongly connected component. Gates of a cycle start from unknown value and are evaluated until no
+        value changes.
+        :param scc: names of gates of the component
+        :param i: index of the component
+        :param scc_of: index of component of each gate
+        :return: names of gates whose value has changed
+        """
+        gates = self.circuit.gates
+        old = [gates[name].value for name in scc]
+        if i not in self._cyclic:
+            g = gates[scc[0]]
+            g.value = general_op3(g.operation, [gates[j].value for j in g.inputs])
+        else:
+            for name in scc:
+                gates[name].value = None
+            changed = True
+            while changed:
+                changed = False
+                for name in scc:
+                    g = gates[name]
+                    val = general_op3(g.operation, [gates[j].value for j in g.inputs])
+                    if val != g.value:
+                        g.value = val
+                        changed = True
+            known = all(gates[j].value is not None
+                        for name in scc for j in gates[name].inputs if scc_of[j] != i)
+            for name in scc:
+                if known and gates[name].value is None:
+                    self.oscillating.add(name)
+                else:
+                    self.oscillating.discard(name)
+        return [name for name, val in zip(scc, old) if gates[name].value != val]
+
+
 class Circuit:
     """
     A class that represents ciruit.
@@ -34,6 +342,8 @@ class Circuit:
     gates -> all of the gates stored in gict (key = name fo the gate, value = Gate instance)
     is_locked -> bool value thats tells if the circuit is locked
     correct_key -> correct key loaded from the file (if the ciruit is locked)
+    _index -> structural index of the circuit, created on first use (see get_index)
+    _simulator -> simulator of the circuit, created on first use (see simulate)
     """
     def __init__(self, bench_file: str):
         """
@@ -48,6 +358,8 @@ class Circuit:
         self.literals = OrderedDict()
         self.gates = OrderedDict()
         self.correct_key = []
+        self._index = None
+        self._simulator = None
         self.load_from_file(bench_file)
 
     def load_from_file(self, bench_file: str) -> None:
@@ -128,43 +440,60 @@ class Circuit:
                         new_gates[new_name2] = Gate(new_operation, new_name2, [self.gates[name].inputs[i], new_name1])
                     new_name1 = new_name2
         self.gates = new_gates
+        self.invalidate()
         for i, name in enumerate(self.gates):
             self.literals[name] = i + 1
 
-    def to_graph(self) -> dict:
+    def get_index(self) -> CircuitIndex:
         """
-        Returns graph representation of circuit.
-        :return: graph as a dict
+        Returns structural index of circuit. The index is built on first call and reused afterwards.
+        :return: CircuitIndex
         """
-        graph = defaultdict(list)
-        for g in self.gates:
-            if self.gates[g].operation != 'input':
-                for i in self.gates[g].inputs:
-                    graph[i].append(g)
-        return graph
+        if self._index is None:
+            self._index = CircuitIndex(self)
+        return self._index
 
-    def simulate(self, inputs: list[bool]) -> list[bool]:
+    def to_graph(self) -> MappingProxyType:
+        """
+        Returns graph representation of circuit. The graph is a read-only view of the index of circuit, so it reflects
+        later changes of circuit. Gates which drive no other gate are not in the graph.
+        :return: graph as a read-only dict
         """
-        Inserts input values to input gates, evaluates ciruits output, which is then returned.
+        return MappingProxyType(self.get_index().fanout)
+
+    def simulate(self, inputs: list[bool], key=None) -> list:
+        """
+        Inserts input values to input gates and key values to key gates, evaluates ciruits output, which is then
+        returned. Values of gates are kept, so following calls only evaluate gates affected by changed inputs. Gates
+        in cycles are evaluated to a fixpoint, outputs which have no stable value are None (see
+        oscillating).
         :param inputs: input values
+        :param key: key values (default: correct key of the circuit if it has one)
         :return: circuits output
         """
-        for i, name in enumerate(self.input_gates):
-            self.gates[name].value = inputs[i]
-        for name in self.gates:
-            if self.gates[name].operation != 'input':
-                inputs = [self.gates[name2].value for name2 in self.gates[name].inputs]
-                self.gates[name].value = general_op(self.gates[name].operation, inputs)
-        return [self.gates[name].value for name in self.output_gates]
+        if self._simulator is None:
+            self._simulator = Simulator(self)
+        return self._simulator.run(inputs, key)
+
+    def oscillating(self) -> set[str]:
+        """
+        Returns names of gates in cycles which had no stable value in the last call of simulate, although all inputs
+        of the cycle were known. Empty if simulate was not called yet.
+        :return: names of oscillating gates
+        """
+        if self._simulator is None:
+            return set()
+        return set(self._simulator.oscillating)
 
     def key_literals(self) -> dict:
         """
         Returns dict of key literals.
         :return: dict of key literals
         """
+        keys = self.get_index().keys
         key_lit = dict()
         for g in self.literals:
-            if 'k' in g:
+            if g in keys:
                 key_lit[g] = self.literals[g]
         return key_lit
 
@@ -173,9 +502,10 @@ class Circuit:
         Returns dict of input literals.
         :return: dict of input literals
         """
+        inputs = self.get_index().inputs
         input_lit = dict()
         for g in self.literals:
-            if g in self.input_gates:
+            if g in inputs:
                 input_lit[g] = self.literals[g]
         return input_lit
 
@@ -184,12 +514,27 @@ class Circuit:
         Returns dict of output literals.
         :return: dict of output literals
         """
+        outputs = self.get_index().outputs
         output_lit = dict()
         for g in self.literals:
-            if g in self.output_gates:
+            if g in outputs:
                 output_lit[g] = self.literals[g]
         return output_lit
 
+    def invalidate(self) -> None:
+        """
+        Drops structural index of circuit. Has to be called after gates were changed directly.
+        :return: None
+        """
+        self._index = None
+
+    def bench_lines(self) -> list[str]:
+        """
+        Returns lines of .bench representation of circuit.
+        :return: lines ending with newline
+        """
+        return format_bench(self.correct_key, self.input_gates, self.key_gates, self.output_gates, self.gates.values())
+
     def to_file(self, file_name: str) -> None:
         """
         Writes ciruit to a file.
@@ -197,14 +542,4 @@ class Circuit:
         :return: None
         """
         with open(file_name, 'w') as f:
-            f.write(f'#{"".join(str(int(i)) for i in self.correct_key)}\n')
-            for in_g in self.input_gates:
-                f.write(f'INPUT({in_g})\n')
-            for k_g in self.key_gates:
-                f.write(f'INPUT({k_g})\n')
-            for out_g in self.output_gates:
-                f.write(f'OUTPUT({out_g})\n')
-            f.write('\n')
-            for g in self.gates:
-                if self.gates[g].operation != 'input':
-                    f.write(f'{self.gates[g].name} = {self.gates[g].operation}({", ".join(self.gates[g].inputs)})\n')
+            f.write(''.join(self.bench_lines()))
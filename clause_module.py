@@ -0,0 +1,111 @@
+import os
+from array import array
+from tempfile import mkstemp
+
+
+class ClauseStore:
+    """
+    A class that stores cnf clauses in flat arrays of integers instead of a list of lists. Budget limits only memory of
+    the store, a SAT solver built from the store holds its own copy of all clauses and spilled clauses are read and
+    parsed again on each iteration over the store.
+    literals -> literals of all clauses stored in memory one after another
+    ends -> position in literals where each clause stored in memory ends
+    budget -> max number of bytes of clauses kept in memory, None means no limit
+    spill_file -> name of the file where clauses over budget are written as clause lines in DIMACS syntax (without
+    the "p cnf" header)
+    spilled -> number of clauses written to spill_file
+    """
+    def __init__(self, budget=None, spill_file=None):
+        """
+        Creates an empty store of clauses.
+        :param budget: max number of bytes of clauses kept in memory
+        :param spill_file: name of the file for clauses over budget (temporary file is created if not given), an
+        existing file is truncated
+        """
+        self.literals = array('i')
+        self.ends = array('q')
+        self.budget = budget
+        self.spill_file = spill_file
+        self.spilled = 0
+        self._remove_spill_file = False
+        if spill_file is not None:
+            open(spill_file, 'w').close()
+        elif budget is not None:
+            fd, self.spill_file = mkstemp(suffix='.cnf')
+            os.close(fd)
+            self._remove_spill_file = True
+
+    def append(self, clause: list[int]) -> None:
+        """
+        Adds a clause to store.
+        :param clause: clause
+        :return: None
+        """
+        self.literals.extend(clause)
+        self.ends.append(len(self.literals))
+        if self.budget is not None and self.nbytes() > self.budget:
+            self.spill()
+
+    def extend(self, clauses) -> None:
+        """
+        Adds clauses to store.
+        :param clauses: iterable of clauses
+        :return: None
+        """
+        for clause in clauses:
+            self.append(clause)
+
+    def nbytes(self) -> int:
+        """
+        Returns number of bytes used by clauses stored in memory.
+        :return: number of bytes
+        """
+        return len(self.literals) * self.literals.itemsize + len(self.ends) * self.ends.itemsize
+
+    def spill(self) -> None:
+        """
+        Writes clauses stored in memory to spill_file as clause lines in DIMACS syntax and removes them from memory.
+        :return: None
+        """
+        lines = []
+        start = 0
+        for end in self.ends:
+            lines.append(' '.join(map(str, self.literals[start:end])) + ' 0\n')
+            start = end
+        with open(self.spill_file, 'a') as f:
+            f.write(''.join(lines))
+        self.spilled += len(self.ends)
+        del self.literals[:]
+        del self.ends[:]
+
+    def close(self) -> None:
+        """
+        Removes all clauses and the spill file if it was created by the store.
+        :return: None
+        """
+        del self.literals[:]
+        del self.ends[:]
+        self.spilled = 0
+        if self._remove_spill_file and os.path.exists(self.spill_file):
+            os.remove(self.spill_file)
+
+    def __len__(self) -> int:
+        return self.spilled + len(self.ends)
+
+    def __iter__(self):
+        """
+        Yields clauses. Spilled clauses are read from spill_file, clauses in memory are yielded as memoryview slices
+        of literals without copying. Clauses can't be added to store while iteration is not finished.
+        """
+        if self.spilled:
+            with open(self.spill_file, 'r') as f:
+                for line in f:
+                    yield [int(lit) for lit in line.split()[:-1]]
+        view = memoryview(self.literals)
+        try:
+            start = 0
+            for end in self.ends:
+                yield view[start:end]
+                start = end
+        finally:
+            view.release()
@@ -1,11 +1,11 @@
 from circuit import Circuit, Gate
 from copy import deepcopy
 from random import choice
-from collections import OrderedDict
+from collections import defaultdict, OrderedDict
 
 
 def find_routes_util(graph: dict, u: str, visited: list[str], curr_route: list[str],
-                     routes: list[list[str]], max_len: int) -> None:
+                     routes: list[list[str]], max_len: int, limit=None) -> None:
     """
     Recursive function for finding routes. Called in "find_routes"
     :param graph: graph representation of Circuit
@@ -14,16 +14,19 @@ def find_routes_util(graph: dict, u: str, visited: list[str], curr_route: list[s
     :param curr_route: current route
     :param routes: all found routes
     :param max_len: max length of routes
+    :param limit: max number of found routes (no limit if None)
     :return:
     """
+    if limit is not None and len(routes) >= limit:
+        return
     visited.append(u)
     curr_route.append(u)
     if len(curr_route) == max_len:
         routes.append(deepcopy(curr_route))
     else:
-        for v in graph[u]:
+        for v in graph.get(u, ()):
             if v not in visited:
-                find_routes_util(graph, v, visited, curr_route, routes, max_len)
+                find_routes_util(graph, v, visited, curr_route, routes, max_len, limit)
     curr_route.pop()
     visited.remove(u)
 
@@ -39,13 +42,13 @@ def find_routes(c: Circuit, graph: dict, max_len: int, max_routes: int) -> list[
     """
     routes = []
     used = []
-    keys = list(graph.keys() - c.input_gates)
+    keys = list(graph.keys() - c.get_index().inputs)
     while len(keys) > 0:
         u = choice(keys)
         visited = []
         paths = []
         curr_path = []
-        find_routes_util(deepcopy(graph), u, visited, curr_path, paths, max_len)
+        find_routes_util(graph, u, visited, curr_path, paths, max_len)
         keys.remove(u)
         if len(paths) > 0:
             for p in paths:
@@ -65,21 +68,40 @@ def add_key(c: Circuit, key: list[bool]) -> None:
     :return: None
     """
     c.correct_key = key
+    index = c.get_index()
     pos = len(c.input_gates)
     items = list(c.gates.items())
+    key_g = []
     for i in range(len(key)):
         k_g = Gate('input', f'k{i}', [])
         c.key_gates.append(k_g.name)
         items.insert(pos, (k_g.name, k_g))
+        key_g.append(k_g)
         pos += 1
     c.gates = OrderedDict(items)
+    for k_g in key_g:
+        index.add_gate(k_g)
+
+
+def mux_gate(mux_name: str, prev_g1: str, prev_g2: str, key_g: str, key_val: bool) -> Gate:
+    """
+    Creates a locking mux gate. Depending on the value of key bit, its will swap the position of inputs of the mux gate.
+    :param mux_name: name of mux gate
+    :param prev_g1: name of 1st previous gate before mux
+    :param prev_g2: name of 2nd previous gate before mux
+    :param key_g: name of key gate
+    :param key_val: value of key gate
+    :return: mux Gate
+    """
+    mux_inputs = [prev_g2, prev_g1] if key_val else [prev_g1, prev_g2]
+    mux_inputs.append(key_g)
+    return Gate('mux', mux_name, mux_inputs)
 
 
 def add_mux_gate(c: Circuit, mux_name: str, next_g: str, prev_g1: str, prev_g2: str, key_g: str, key_val: bool,
                  pos: int) -> None:
     """
-    Adds a locking mux gate to Circuit. Depending on the value of key bit, its will swap the position of inputs of the
-    mux gate.
+    Adds a locking mux gate to Circuit (see mux_gate).
     :param c: Circuit
     :param mux_name: name of mux gate
     :param next_g: name of following gate after mux
@@ -90,15 +112,15 @@ def add_mux_gate(c: Circuit, mux_name: str, next_g: str, prev_g1: str, prev_g2:
     :param pos: position where to insert mux gate in Circuit
     :return: None
     """
-    mux_g = Gate('mux', mux_name, [prev_g1, prev_g2])
+    index = c.get_index()
+    mux_g = mux_gate(mux_name, prev_g1, prev_g2, key_g, key_val)
     i = c.gates[next_g].inputs.index(prev_g1)
     c.gates[next_g].inputs[i] = mux_name
     items = list(c.gates.items())
     items.insert(pos, (mux_name, mux_g))
     c.gates = OrderedDict(items)
-    if key_val:
-        mux_g.inputs.reverse()
-    mux_g.inputs.append(key_g)
+    index.add_gate(mux_g)
+    index.replace_input(next_g, prev_g1, mux_name)
 
 
 def available_gates(c: Circuit, routes: list[list[str]]) -> list[str]:
@@ -108,46 +130,66 @@ def available_gates(c: Circuit, routes: list[list[str]]) -> list[str]:
     :param routes: lists of gates creating a cycle
     :return: list of gates
     """
-    avail_gates = set(c.gates.keys() - set(c.input_gates) - set(c.key_gates))
+    index = c.get_index()
+    avail_gates = set(c.gates.keys() - index.inputs - index.keys)
     for r in routes:
         avail_gates -= set(r)
     return list(avail_gates)
 
 
-def lock_route(c: Circuit, graph: dict, route: list[str], key: list[bool], r_counter: int, avail_g: list[str]) -> None:
+def insert_route_muxes(route: list[str], key: list[bool], r_counter: int, avail_g: list[str], inputs_of, fanout_of,
+                       add_mux, rand_choice) -> None:
     """
-    Inserts mux key gates to Circuit in a way so it creates a cycle from nodes in route (last node of route is
-    connected to the 1st node).
-    :param avail_g: gates thats can be connected with mux gates
-    :param c: Circuit
-    :param graph: graph representation of Circuit
+    Decides where mux key gates are inserted so they create a cycle from nodes in route (last node of route is
+    connected to the 1st node). If a gate of route drives only the inserted mux, another mux is inserted before
+    a randomly selected gate, so the gate is not left with a single output. Used by lock_route and by locked variants.
     :param route: list of gates creating a cycle
     :param key: key
     :param r_counter: counter
+    :param avail_g: gates thats can be connected with mux gates
+    :param inputs_of: function returning current input gates of a gate
+    :param fanout_of: function returning number of outputs of a gate in circuit before locking
+    :param add_mux: function inserting a mux gate, called with (mux_name, next_g, prev_g1, prev_g2, key_g, key_val)
+    :param rand_choice: function selecting a random item of a list
     :return: None
     """
     for i, next_g in enumerate(route):
         mux_name = f'm{r_counter + i}'
         key_g = f'k{r_counter + i}'
-        pos = list(c.gates.keys()).index(next_g)
 
         if i == 0:
-            prev_g1 = c.gates[next_g].inputs[0]
+            prev_g1 = inputs_of(next_g)[0]
             prev_g2 = route[-1]
-            add_mux_gate(c, mux_name, next_g, prev_g1, prev_g2, key_g, key[r_counter + i], pos)
-
         else:
             prev_g1 = route[i - 1]
-            prev_g2 = choice(avail_g)
-            add_mux_gate(c, mux_name, next_g, prev_g1, prev_g2, key_g, key[r_counter + i], pos)
+            prev_g2 = rand_choice(avail_g)
+        add_mux(mux_name, next_g, prev_g1, prev_g2, key_g, key[r_counter + i])
 
-        if len(graph[prev_g1]) == 1:
-            new_next_g = choice(avail_g)
-            new_pos = list(c.gates.keys()).index(new_next_g)
+        if fanout_of(prev_g1) == 1:
+            new_next_g = rand_choice(avail_g)
             prev_g2 = prev_g1
-            prev_g1 = c.gates[new_next_g].inputs[0]
-            mux_name = f'mm{r_counter + i}'
-            add_mux_gate(c, mux_name, new_next_g, prev_g1, prev_g2, key_g, key[r_counter + i], new_pos)
+            prev_g1 = inputs_of(new_next_g)[0]
+            add_mux(f'mm{r_counter + i}', new_next_g, prev_g1, prev_g2, key_g, key[r_counter + i])
+
+
+def lock_route(c: Circuit, graph: dict, route: list[str], key: list[bool], r_counter: int, avail_g: list[str]) -> None:
+    """
+    Inserts mux key gates to Circuit in a way so it creates a cycle from nodes in route (last node of route is
+    connected to the 1st node).
+    :param avail_g: gates thats can be connected with mux gates
+    :param c: Circuit
+    :param graph: graph representation of Circuit before locking (fanout is not updated by inserted mux gates)
+    :param route: list of gates creating a cycle
+    :param key: key
+    :param r_counter: counter
+    :return: None
+    """
+    def add_mux(mux_name, next_g, prev_g1, prev_g2, key_g, key_val):
+        pos = list(c.gates.keys()).index(next_g)
+        add_mux_gate(c, mux_name, next_g, prev_g1, prev_g2, key_g, key_val, pos)
+
+    insert_route_muxes(route, key, r_counter, avail_g, lambda g: c.gates[g].inputs, lambda g: len(graph.get(g, ())),
+                       add_mux, choice)
 
 
 def lock_circuit(c: Circuit, max_len: int, max_num: int, key: list[bool]) -> Circuit:
@@ -161,7 +203,7 @@ def lock_circuit(c: Circuit, max_len: int, max_num: int, key: list[bool]) -> Cir
     """
     c_l = deepcopy(c)
     add_key(c_l, key)
-    g = c_l.to_graph()
+    g = defaultdict(list, ((u, list(v)) for u, v in c_l.to_graph().items()))
 
     routes = find_routes(c_l, g, max_len, max_num)
     attempts = 100
@@ -94,3 +94,109 @@ def general_op(operation: str, inputs: list[bool]) -> bool:
         return multi_xnor(inputs)
     elif operation == 'mux':
         return mux_op(inputs[0], inputs[1], inputs[2])
+
+
+def and_op3(a, b):
+    if (a is not None and not a) or (b is not None and not b):
+        return False
+    if a is None or b is None:
+        return None
+    return True
+
+
+def or_op3(a, b):
+    if (a is not None and a) or (b is not None and b):
+        return True
+    if a is None or b is None:
+        return None
+    return False
+
+
+def xor_op3(a, b):
+    if a is None or b is None:
+        return None
+    return bool(a) ^ bool(b)
+
+
+def not_op3(a):
+    if a is None:
+        return None
+    return not a
+
+
+def mux_op3(a, b, s):
+    if s is None:
+        return a if a == b else None
+    return b if s else a
+
+
+def general_op3(operation: str, inputs: list) -> bool | None:
+    """
+    Returns result values of boolean operation in three-valued logic, where None stands for unknown value. Gates with
+    more than 2 inputs are evaluated the same way as in general_op.
+    :param operation: type of operation
+    :param inputs: input values (True, False or None)
+    :return: result values of opereation (True, False or None)
+    """
+    if operation == 'buf':
+        return inputs[0]
+    elif operation == 'not':
+        return not_op3(inputs[0])
+    elif operation == 'mux':
+        return mux_op3(inputs[0], inputs[1], inputs[2])
+    res = inputs[0]
+    if operation == 'or':
+        for i in inputs[1:]:
+            res = or_op3(res, i)
+    elif operation == 'nor':
+        for i in inputs[1:]:
+            res = not_op3(or_op3(res, i))
+    elif operation in ('and', 'nand'):
+        for i in inputs[1:]:
+            res = and_op3(res, i)
+        if operation == 'nand':
+            res = not_op3(res)
+    elif operation == 'xor':
+        for i in inputs[1:]:
+            res = xor_op3(res, i)
+    elif operation == 'xnor':
+        for i in inputs[1:]:
+            res = not_op3(xor_op3(res, i))
+    return res
+
+
+def general_op_bits(operation: str, inputs: list[tuple[int, int]]) -> tuple[int, int]:
+    """
+    Returns result values of boolean operation in three-valued logic evaluated on packed values, where each bit of an
+    integer holds the value of one simulated pattern. A value is a pair (ones, zeros) of bits of patterns where the
+    value is known to be True and known to be False, patterns with neither bit set are unknown.
+    :param operation: type of operation
+    :param inputs: packed input values
+    :return: packed result values of operation
+    """
+    if operation == 'buf':
+        return inputs[0]
+    elif operation == 'not':
+        return inputs[0][1], inputs[0][0]
+    elif operation == 'mux':
+        (a1, a0), (b1, b0), (s1, s0) = inputs
+        return s0 & a1 | s1 & b1 | a1 & b1, s0 & a0 | s1 & b0 | a0 & b0
+    r1, r0 = inputs[0]
+    if operation == 'or':
+        for i1, i0 in inputs[1:]:
+            r1, r0 = r1 | i1, r0 & i0
+    elif operation == 'nor':
+        for i1, i0 in inputs[1:]:
+            r1, r0 = r0 & i0, r1 | i1
+    elif operation in ('and', 'nand'):
+        for i1, i0 in inputs[1:]:
+            r1, r0 = r1 & i1, r0 | i0
+        if operation == 'nand':
+            r1, r0 = r0, r1
+    elif operation == 'xor':
+        for i1, i0 in inputs[1:]:
+            r1, r0 = r1 & i0 | r0 & i1, r1 & i1 | r0 & i0
+    elif operation == 'xnor':
+        for i1, i0 in inputs[1:]:
+            r1, r0 = r1 & i1 | r0 & i0, r1 & i0 | r0 & i1
+    return r1, r0
@@ -0,0 +1,289 @@
+import os
+from hashlib import sha1
+from collections import Counter, OrderedDict
+from copy import deepcopy
+from multiprocessing import Pool
+from random import Random
+from circuit import Circuit, Gate, format_bench
+from locking_module import find_routes_util, available_gates, add_key, mux_gate, insert_route_muxes
+
+
+class LockedVariant:
+    """
+    A class that represents a locked circuit as changes made to a shared base circuit, so that many locked variants
+    can be held in memory without copying the base circuit.
+    base -> Circuit which was locked
+    max_len -> length of routes
+    max_num -> number of routes
+    key -> key
+    seed -> seed of random generator used for locking
+    routes -> locked routes
+    inputs -> new inputs of gates changed by locking (key = name of the gate, value = names of input gates)
+    muxes -> inserted mux gates (key = name of the gate they are placed before, value = list of Gates)
+    """
+    def __init__(self, base: Circuit, max_len: int, max_num: int, key: list[bool], seed: int,
+                 routes: list[list[str]], inputs: dict, muxes: dict):
+        """
+        Creates a locked variant of base circuit.
+        :param base: Circuit which was locked
+        :param max_len: length of routes
+        :param max_num: number of routes
+        :param key: key
+        :param seed: seed of random generator used for locking
+        :param routes: locked routes
+        :param inputs: new inputs of gates changed by locking
+        :param muxes: inserted mux gates
+        """
+        self.base = base
+        self.max_len = max_len
+        self.max_num = max_num
+        self.key = key
+        self.seed = seed
+        self.routes = routes
+        self.inputs = inputs
+        self.muxes = muxes
+
+    def name(self) -> str:
+        """
+        Returns name of the file of variant (name of the base file, max_len, max_num, seed and hash of the key).
+        :return: name of the file
+        """
+        base_name = os.path.splitext(os.path.basename(self.base.file_name))[0]
+        key_hash = sha1(''.join(str(int(i)) for i in self.key).encode()).hexdigest()[:8]
+        return f'{base_name}_{self.max_len}_{self.max_num}_{self.seed}_{key_hash}.bench'
+
+    def bench_lines(self) -> list[str]:
+        """
+        Returns lines of .bench representation of locked circuit (same as Circuit.bench_lines of to_circuit).
+        :return: lines ending with newline
+        """
+        b = self.base
+        key_gates = [f'k{i}' for i in range(len(self.key))]
+        return format_bench(self.key, b.input_gates, key_gates, b.output_gates, self._gates())
+
+    def _gates(self):
+        """
+        Yields gates of locked circuit in order, inserted mux gates are yielded before the gate they are placed before.
+        """
+        for g in self.base.gates.values():
+            yield from self.muxes.get(g.name, ())
+            if g.name in self.inputs:
+                yield Gate(g.operation, g.name, self.inputs[g.name])
+            else:
+                yield g
+
+    def to_circuit(self) -> Circuit:
+        """
+        Returns locked circuit as a standalone Circuit.
+        :return: locked Circuit
+        """
+        c = deepcopy(self.base)
+        add_key(c, list(self.key))
+        for name, inputs in self.inputs.items():
+            c.gates[name].inputs = list(inputs)
+        items = []
+        for name, g in c.gates.items():
+            for m in self.muxes.get(name, ()):
+                items.append((m.name, Gate(m.operation, m.name, list(m.inputs))))
+            items.append((name, g))
+        c.gates = OrderedDict(items)
+        c.invalidate()
+        return c
+
+
+def route_pool(c: Circuit, max_len: int, routes_per_gate=8) -> dict:
+    """
+    Finds candidate routes of length max_len starting in each gate. The pool is shared by all variants with the same
+    max_len, so routes are not searched again for every variant. Only the first routes_per_gate routes found by depth
+    first search are kept for each gate, so variants choose from fewer routes than lock_circuit does, larger
+    routes_per_gate gives more different variants at the cost of memory and search time.
+    :param c: Circuit
+    :param max_len: length of routes
+    :param routes_per_gate: max number of routes starting in one gate
+    :return: dict (key = name of the 1st gate of routes, value = routes)
+    """
+    graph = c.to_graph()
+    pool = dict()
+    for u in sorted(graph.keys() - c.get_index().inputs):
+        routes = []
+        find_routes_util(graph, u, [], [], routes, max_len, routes_per_gate)
+        if routes:
+            pool[u] = routes
+    return pool
+
+
+def select_routes(pool: dict, max_num: int, rng: Random) -> list[list[str]]:
+    """
+    Randomly selects max_num routes from pool which don't share any gate. Start gates and routes starting in each gate
+    are tried in random order.
+    :param pool: candidate routes (see route_pool)
+    :param max_num: number of routes
+    :param rng: random generator
+    :return: routes
+    """
+    routes = []
+    used = set()
+    starts = list(pool)
+    rng.shuffle(starts)
+    for u in starts:
+        for p in rng.sample(pool[u], len(pool[u])):
+            if used.isdisjoint(p):
+                routes.append(p)
+                used.update(p)
+                if len(routes) == max_num:
+                    return routes
+    return routes
+
+
+def lock_variant(c: Circuit, pool: dict, avail_g: list[str], max_len: int, max_num: int, key: list[bool],
+                 seed: int, attempts=100) -> (list[list[str]], dict, dict):
+    """
+    Locks routes selected from pool the same way as lock_route does, but records the changes instead of modifying
+    the circuit. Like lock_circuit, routes are selected again if fewer than max_num routes are found.
+    :param c: base Circuit
+    :param pool: candidate routes (see route_pool)
+    :param avail_g: gates that can be connected with mux gates before routes are selected (see available_gates)
+    :param max_len: length of routes
+    :param max_num: number of routes
+    :param key: key
+    :param seed: seed of random generator
+    :param attempts: max number of repeated selections of routes
+    :return: routes, new inputs of changed gates, inserted mux gates
+    """
+    rng = Random(seed)
+    routes = select_routes(pool, max_num, rng)
+    while len(routes) < max_num and attempts > 0:
+        routes = select_routes(pool, max_num, rng)
+        attempts -= 1
+    used = set().union(*routes)
+    avail_g = [g for g in avail_g if g not in used]
+    graph = c.to_graph()
+    inputs = dict()
+    muxes = dict()
+
+    def inputs_of(g):
+        return inputs.get(g, c.gates[g].inputs)
+
+    def add_mux(mux_name, next_g, prev_g1, prev_g2, key_g, key_val):
+        muxes.setdefault(next_g, []).append(mux_gate(mux_name, prev_g1, prev_g2, key_g, key_val))
+        next_inputs = inputs.setdefault(next_g, list(c.gates[next_g].inputs))
+        next_inputs[next_inputs.index(prev_g1)] = mux_name
+
+    r_counter = 0
+    for route in routes:
+        insert_route_muxes(route, key, r_counter, avail_g, inputs_of,
+                           lambda g: len(graph.get(g, ())), add_mux, rng.choice)
+        r_counter += len(route)
+    return routes, inputs, muxes
+
+
+_worker_state = None
+
+
+def _init_worker(c: Circuit, pools: dict, avail: dict) -> None:
+    """
+    Stores base circuit and route pools in a worker process, so they are sent to each worker only once.
+    :param c: base Circuit
+    :param pools: route pools for each max_len
+    :param avail: available gates for each max_len
+    :return: None
+    """
+    global _worker_state
+    _worker_state = (c, pools, avail)
+
+
+def _lock_config(config: tuple) -> (list[list[str]], dict, dict):
+    """
+    Locks one configuration in a worker process.
+    :param config: (max_len, max_num, key, seed)
+    :return: routes, new inputs of changed gates, inserted mux gates
+    """
+    c, pools, avail = _worker_state
+    max_len, max_num, key, seed = config
+    return lock_variant(c, pools[max_len], avail[max_len], max_len, max_num, key, seed)
+
+
+def _lock_configs(c: Circuit, configs: list[tuple], pools: dict, avail: dict, processes) -> list[tuple]:
+    """
+    Locks configurations in this process or in parallel in worker processes.
+    :param c: base Circuit
+    :param configs: list of (max_len, max_num, key, seed)
+    :param pools: route pools for each max_len
+    :param avail: available gates for each max_len
+    :param processes: number of worker processes (default: number of CPUs, 1 runs in this process)
+    :return: list of (routes, new inputs of changed gates, inserted mux gates)
+    """
+    if processes == 1:
+        return [lock_variant(c, pools[max_len], avail[max_len], max_len, max_num, key, seed)
+                for max_len, max_num, key, seed in configs]
+    chunksize = max(1, len(configs) // (4 * (processes or os.cpu_count())))
+    with Pool(processes, initializer=_init_worker, initargs=(c, pools, avail)) as p:
+        return p.map(_lock_config, configs, chunksize)
+
+
+def generate_variants(c: Circuit, configs: list[tuple], processes=None, routes_per_gate=8) -> list[LockedVariant]:
+    """
+    Generates locked variants of circuit. Route pools are built once for each max_len and shared by all variants,
+    variants are locked in parallel. If max_num routes can't be selected for some configurations, the pool of their
+    max_len is built again with 4 times more routes per gate and only these configurations are locked again, until
+    the pool holds all routes. Raises ValueError if max_num routes still can't be found.
+    :param c: base Circuit (not locked)
+    :param configs: list of (max_len, max_num, key, seed)
+    :param processes: number of worker processes (default: number of CPUs, 1 runs in this process)
+    :param routes_per_gate: max number of candidate routes starting in one gate at first (see route_pool)
+    :return: locked variants
+    """
+    pools = dict()
+    avail = dict()
+    sizes = dict()
+    for max_len, _, _, _ in configs:
+        if max_len not in pools:
+            pools[max_len] = route_pool(c, max_len, routes_per_gate)
+            avail[max_len] = sorted(available_gates(c, []))
+            sizes[max_len] = routes_per_gate
+
+    results = _lock_configs(c, configs, pools, avail, processes)
+    short = [i for i, (config, res) in enumerate(zip(configs, results)) if len(res[0]) < config[1]]
+    while short:
+        grown = set()
+        for max_len in {configs[i][0] for i in short}:
+            size = sizes[max_len]
+            if size is not None and any(len(routes) >= size for routes in pools[max_len].values()):
+                sizes[max_len] = size * 4
+                pools[max_len] = route_pool(c, max_len, size * 4)
+                grown.add(max_len)
+        if not grown:
+            break
+        retry = [i for i in short if configs[i][0] in grown]
+        for i, res in zip(retry, _lock_configs(c, [configs[i] for i in retry], pools, avail, processes)):
+            results[i] = res
+        short = [i for i in short if len(results[i][0]) < configs[i][1]]
+
+    if short:
+        raise ValueError('; '.join(f"Couldn't find {configs[i][1]} routes of length {configs[i][0]} for seed "
+                                   f"{configs[i][3]}, found {len(results[i][0])} routes" for i in short))
+    return [LockedVariant(c, max_len, max_num, key, seed, routes, inputs, muxes)
+            for (max_len, max_num, key, seed), (routes, inputs, muxes) in zip(configs, results)]
+
+
+def write_variants(variants: list[LockedVariant], directory: str, buffer_size=1 << 20) -> list[str]:
+    """
+    Writes locked variants to .bench files. Each file is written with a single write call through a large buffer.
+    Raises ValueError if two variants have the same name (same configuration), nothing is written in that case.
+    :param variants: locked variants
+    :param directory: output directory
+    :param buffer_size: size of file buffer in bytes
+    :return: names of written files
+    """
+    names = [v.name() for v in variants]
+    if len(set(names)) != len(names):
+        duplicates = sorted(n for n, count in Counter(names).items() if count > 1)
+        raise ValueError(f'Variants with the same configuration: {", ".join(duplicates)}')
+    os.makedirs(directory, exist_ok=True)
+    file_names = []
+    for v, name in zip(variants, names):
+        file_name = os.path.join(directory, name)
+        with open(file_name, 'w', buffering=buffer_size) as f:
+            f.write(''.join(v.bench_lines()))
+        file_names.append(file_name)
+    return file_names